@@ -0,0 +1,794 @@
+import os
+import functools
+import hashlib
+import importlib
+import mmap
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import MappingProxyType
+from PIL import Image as PILImage
+from io import BytesIO
+try:
+    # SIMD-accelerated drop-in replacement for the stdlib codec
+    import pybase64 as base64
+except ImportError:
+    import base64
+try:
+    # Faster (de)serializer for API payloads; orjson works on bytes in both directions
+    import orjson as json
+except ImportError:
+    import json
+
+API_URL = os.environ.get("ZAI_BASE_URL", "https://api.z.ai/api/paas/v4")
+CHAT_COMPLETIONS_URL = f"{API_URL}/chat/completions"
+MODEL = os.environ.get("ZAI_MODEL_VISION", "glm-4.6v")
+# Pillow formats the API accepts as-is; anything else is re-encoded to JPEG
+DATA_URL_PREFIXES = MappingProxyType({
+    "PNG": "data:image/png;base64,",
+    "JPEG": "data:image/jpeg;base64,",
+    "WEBP": "data:image/webp;base64,",
+})
+# Longest image side sent to the model; larger uploads are downscaled before encoding
+MAX_IMAGE_SIDE = 1024
+LOW_DETAIL_IMAGE_SIDE = 512
+# Re-encoded images are lossy JPEGs; Huffman optimization is skipped as it costs ~2x encode time for ~1% size
+JPEG_QUALITY = 85
+# Uploads above this are rejected before any decode/encode work
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+# Accepted-format uploads within MAX_IMAGE_SIDE and at most this size are sent without re-encoding;
+# bigger ones (e.g. a barely compressed PNG) are cheaper to send as a re-encoded JPEG
+PASSTHROUGH_MAX_BYTES = 4 * 1024 * 1024
+# Per-thread encode buffers that grew past this (e.g. for a large passthrough) are released, not kept for reuse
+SCRATCH_BUFFER_MAX_BYTES = 2 * 1024 * 1024
+# Encoded data URLs are also kept on disk so they survive restarts and re-uploads
+CACHE_DIR = os.path.expanduser(os.environ.get("ZAI_CACHE_DIR", "~/.cache/zai-vision-suite"))
+# Part of every cache key; bump it whenever a change alters the encoded output, so data URLs
+# cached on disk by an older encoder are not served again
+CACHE_VERSION = 2
+DISK_CACHE_MAX_ENTRIES = 128
+MEMORY_CACHE_MAX_ENTRIES = 32
+# (connect, read): fail fast when the host is unreachable, but give the model time to answer
+API_TIMEOUT = (3.05, 60)
+# Requests in flight to the API across all users; also the session's pool size
+API_MAX_CONCURRENT = 8
+# Frame analyses in flight at once for one video
+FRAME_CONCURRENCY = API_MAX_CONCURRENT
+# Successful replies are reused for identical requests (same key, prompt, images and limit)
+RESPONSE_CACHE_MAX_ENTRIES = 128
+RESPONSE_CACHE_TTL = 3600
+# Frames sent together in one request when a video is analyzed in batches
+BATCH_MAX_FRAMES = 10
+# Parallel decode segments for the OpenCV backend, one capture each
+DECODE_SEGMENTS = min(4, os.cpu_count() or 1)
+# Sampled frames further apart than this are reached by seeking rather than grabbing
+# through; a seek re-decodes at most one GOP, typically a few seconds of video
+CV2_SEEK_MIN_GAP = 300
+
+# Prompt templates shared by both UIs
+ANALYZE_PROMPT = "Analyze this image in {detail} detail. Describe the scene, objects, colors, and mood."
+OCR_PROMPT = "Extract all text from this image. Language: {lang}. Preserve original formatting and structure."
+SEARCH_PROMPT = "Describe this image. What search terms would find this on the web for {search_type}?"
+DETAIL_LEVELS = ("low", "high", "auto")
+OCR_LANGUAGES = ("auto", "english", "chinese", "spanish", "french", "german")
+SEARCH_TYPES = ("web", "products", "similar")
+# Every choice the UIs offer is formatted once here, so a click is just a lookup.
+# Read-only, so concurrent handlers can share them without locking
+ANALYZE_PROMPTS = MappingProxyType({d: ANALYZE_PROMPT.format(detail=d) for d in DETAIL_LEVELS})
+OCR_PROMPTS = MappingProxyType({lang: OCR_PROMPT.format(lang=lang) for lang in OCR_LANGUAGES})
+SEARCH_PROMPTS = MappingProxyType({t: SEARCH_PROMPT.format(search_type=t) for t in SEARCH_TYPES})
+CHAT_DEFAULT_PROMPT = "What do you see in this image?"
+FRAME_PROMPT = "Analyze this video frame. Describe what you see in detail including objects, people, actions, setting, and any notable elements."
+BATCH_FRAME_PROMPT = (
+    "These {count} images are consecutive frames sampled in order from one video. For each frame, "
+    "describe what you see including objects, people, actions, setting, and any notable elements, "
+    "and note what changed since the previous frame. Reply with only a JSON object mapping each "
+    "frame number (1 to {count}) to its analysis."
+)
+
+NO_IMAGE_MESSAGE = "Please upload an image."
+NO_VIDEO_MESSAGE = "Please upload a video file."
+DEMO_MODE_MESSAGE = "**Demo Mode** - Enter your Z AI API key above for real AI."
+DEMO_IMAGE_MESSAGE = DEMO_MODE_MESSAGE + "\n\nUpload an image and enter your key to use real AI."
+DEMO_VIDEO_MESSAGE = DEMO_MODE_MESSAGE + "\n\nUpload a video and enter your key to use real AI."
+BATCH_UNSPLIT_MESSAGE = "See frame 1: the combined analysis could not be split per frame."
+NO_FRAME_ANALYSIS_MESSAGE = "No analysis was returned for this frame."
+
+
+# Encoded data URLs by content hash, most recently used last
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+
+def encode_image(img, max_side=MAX_IMAGE_SIDE):
+    """Encode an image file path or uploaded file object as a base64 data URL."""
+    if img is None: return None
+    if isinstance(img, (str, os.PathLike)):
+        # Key the cache on mtime/size as well so a re-upload to the same path is re-encoded
+        path = os.fspath(img)
+        stat = os.stat(path)
+        return _encode_path_cached(path, stat.st_mtime_ns, stat.st_size, max_side)
+    img.seek(0)
+    return _encode(img, img.getbuffer().nbytes, max_side)
+
+
+@functools.lru_cache(maxsize=32)
+def _encode_path_cached(path, mtime, size, max_side):
+    return _encode(path, size, max_side)
+
+
+def _encode(src, size, max_side):
+    _validate_image(src, size)
+
+    # The same picture uploaded in another tab (or as a Streamlit file object, which has
+    # no path to key on) is found by content in memory first, then on disk
+    key = _content_key(src, max_side)
+    data_url = _memory_cache_get(key)
+    if data_url is None:
+        data_url = _disk_cache_get(key)
+        if data_url is None:
+            data_url = _encode_uncached(src, size, max_side)
+            _disk_cache_put(key, data_url)
+        _memory_cache_put(key, data_url)
+    return data_url
+
+
+def _encode_uncached(src, size, max_side):
+    with PILImage.open(src) as img:
+        # Uploads already in an accepted format and small enough are sent as-is;
+        # Image.open only parsed the header, so nothing has been decoded yet
+        if img.format in DATA_URL_PREFIXES and max(img.size) <= max_side and size <= PASSTHROUGH_MAX_BYTES:
+            return _b64_source(src, img.format)
+
+        # For JPEGs, libjpeg decodes at the smallest 1/2, 1/4 or 1/8 DCT scale that still
+        # covers max_side, so most of a large photo's pixels are never decoded (no-op otherwise)
+        img.draft("RGB", (max_side, max_side))
+        img.thumbnail((max_side, max_side), PILImage.LANCZOS)
+        out = _DataURLWriter("JPEG")
+        _to_rgb(img).save(out, "JPEG", quality=JPEG_QUALITY)
+    return out.data_url()
+
+
+def _to_rgb(img):
+    """RGB version of img for JPEG, with transparency composited onto white.
+
+    A plain convert("RGB") drops alpha and leaves transparent areas black, which makes
+    dark text or logos on a transparent background unreadable.
+    """
+    if img.mode not in ("RGBA", "LA", "PA") and "transparency" not in img.info:
+        return img.convert("RGB")
+    rgba = img.convert("RGBA")
+    flattened = PILImage.new("RGB", rgba.size, (255, 255, 255))
+    flattened.paste(rgba, mask=rgba.getchannel("A"))
+    return flattened
+
+
+def _content_key(src, max_side):
+    """Hash the file contents (BLAKE2b, 128-bit) together with the target size and encoder settings."""
+    prefix = f"{CACHE_VERSION}:{max_side}:{JPEG_QUALITY}:{PASSTHROUGH_MAX_BYTES}:"
+    digest = hashlib.blake2b(prefix.encode(), digest_size=16)
+    if isinstance(src, str):
+        with open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    else:
+        digest.update(src.getbuffer())
+    return digest.hexdigest()
+
+
+def _memory_cache_get(key):
+    with _memory_cache_lock:
+        data_url = _memory_cache.get(key)
+        if data_url is not None:
+            _memory_cache.move_to_end(key)
+        return data_url
+
+
+def _memory_cache_put(key, data_url):
+    with _memory_cache_lock:
+        _memory_cache[key] = data_url
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > MEMORY_CACHE_MAX_ENTRIES:
+            _memory_cache.popitem(last=False)
+
+
+def _disk_cache_get(key):
+    try:
+        with open(os.path.join(CACHE_DIR, key), encoding="ascii") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+@functools.cache
+def _ensure_cache_dir():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+
+def _disk_cache_put(key, data_url):
+    # The disk cache is best-effort: a read-only or full filesystem just means no caching
+    try:
+        _ensure_cache_dir()
+        path = os.path.join(CACHE_DIR, key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="ascii") as f:
+                f.write(data_url)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Don't leave a partial temp file behind when the write fails (e.g. disk full)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        entries = [e for e in os.scandir(CACHE_DIR) if e.is_file() and not e.name.endswith(".tmp")]
+        if len(entries) > DISK_CACHE_MAX_ENTRIES:
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[:len(entries) - DISK_CACHE_MAX_ENTRIES]:
+                os.remove(entry.path)
+    except OSError:
+        pass
+
+
+def _validate_image(src, size):
+    """Reject oversized or non-image uploads using only the file size and its first bytes."""
+    if size > MAX_IMAGE_BYTES:
+        raise ValueError(f"Image is too large ({size / 2**20:.1f} MB). The limit is {MAX_IMAGE_BYTES // 2**20} MB.")
+    if isinstance(src, str):
+        with open(src, "rb") as f:
+            header = f.read(12)
+    else:
+        header = bytes(src.getbuffer()[:12])
+    if _sniff_image_type(header) is None:
+        raise ValueError("Unsupported image type. Upload a PNG, JPEG, GIF or WebP image.")
+
+
+def _sniff_image_type(header):
+    """Return the image subtype ("png", "jpeg", ...) from a file's magic bytes, or None."""
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _b64_source(src, fmt):
+    """Build a data URL from the original bytes of a file path or file object."""
+    out = _DataURLWriter(fmt)
+    if isinstance(src, str):
+        # Map the file rather than read() it so it isn't copied into memory first
+        with open(src, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            out.write(mm)
+    else:
+        out.write(src.getbuffer())
+    return out.data_url()
+
+
+class _DataURLWriter:
+    """Write-only file object that base64-encodes bytes straight into a data URL.
+
+    PIL saves into it chunk by chunk, so the raw image bytes, their base64 form
+    and a prefixed copy never have to be held in memory at the same time.
+    """
+
+    def __init__(self, fmt):
+        self._out = _scratch_buffer()
+        self._out.write(DATA_URL_PREFIXES[fmt].encode("ascii"))
+        self._pending = b""
+
+    def write(self, data):
+        view = memoryview(data).cast("B")
+        size = len(view)
+        # Only whole 3-byte groups can be encoded without padding; carry the rest over
+        if self._pending:
+            fill = 3 - len(self._pending)
+            self._pending += bytes(view[:fill])
+            view = view[fill:]
+            if len(self._pending) < 3:
+                return size
+            self._out.write(base64.b64encode(self._pending))
+        cut = len(view) - len(view) % 3
+        self._out.write(base64.b64encode(view[:cut]))
+        self._pending = bytes(view[cut:])
+        return size
+
+    def data_url(self):
+        self._out.write(base64.b64encode(self._pending))
+        self._pending = b""
+        with self._out.getbuffer() as view, view[:self._out.tell()] as written:
+            url = str(written, "ascii")
+        if self._out.tell() > SCRATCH_BUFFER_MAX_BYTES:
+            _scratch.buf = None
+        return url
+
+
+_scratch = threading.local()
+
+
+def _scratch_buffer():
+    """Per-thread BytesIO, rewound for each encode so its storage is reused rather than regrown.
+
+    A buffer that grew past SCRATCH_BUFFER_MAX_BYTES is dropped by its writer, so one
+    large encode doesn't pin that much memory in every worker thread.
+    """
+    buf = getattr(_scratch, "buf", None)
+    if buf is None:
+        buf = _scratch.buf = BytesIO()
+    buf.seek(0)
+    return buf
+
+
+# Futures for chat completions currently in flight, keyed by a hash of the request
+_inflight = {}
+_inflight_lock = threading.Lock()
+# Replies by request hash, as (expiry time, text); the hash covers the API key, so users never share entries
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+# Held for the length of each request so bursts queue here instead of tripping the rate limit
+_api_slots = threading.BoundedSemaphore(API_MAX_CONCURRENT)
+
+
+@functools.cache
+def get_session():
+    """Shared session so repeated calls reuse the pooled keep-alive connection to the API."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    # Jittered backoff keeps concurrent users from retrying in lockstep; Retry-After is honoured.
+    # raise_on_status=False hands the last response back so a final 429 surfaces as an HTTPError.
+    # read=0: a POST that timed out may still be generating (and billing), so it is never re-sent.
+    retries = Retry(total=4, read=0, backoff_factor=0.5, backoff_max=30, backoff_jitter=0.3,
+                    status_forcelist=[429, 500, 502, 503, 504], allowed_methods=frozenset({"POST"}),
+                    respect_retry_after_header=True, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=API_MAX_CONCURRENT, max_retries=retries)
+    # Also pooled when ZAI_BASE_URL points at a plain-HTTP proxy or local gateway
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+
+def _image_urls(image_url):
+    return (image_url,) if isinstance(image_url, str) else image_url
+
+
+def _messages(image_url, prompt):
+    """Single user turn carrying one or more images and their prompt."""
+    return [{
+        "role": "user",
+        "content": [
+            *({"type": "image_url", "image_url": {"url": url}} for url in _image_urls(image_url)),
+            {"type": "text", "text": prompt}
+        ]
+    }]
+
+
+def _payload(image_url, prompt, max_tokens, stream=False):
+    """Serialized request body; Content-Type and the pooled connection come from the session."""
+    payload = {"model": MODEL, "messages": _messages(image_url, prompt), "max_tokens": max_tokens}
+    if stream:
+        payload["stream"] = True
+    return json.dumps(payload)
+
+
+def chat_completion(image_url, prompt, api_key, max_tokens):
+    """POST an image (or a tuple of them) + prompt to the chat completions endpoint and return the reply text.
+
+    Identical requests (same key, prompt, images and limit) that are already in flight share
+    one POST, and those answered within RESPONSE_CACHE_TTL are served from memory.
+    """
+    key = _request_key(image_url, prompt, api_key, max_tokens)
+    cached = _response_cache_get(key)
+    if cached is not None:
+        return cached
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = _inflight[key] = Future()
+    if not is_owner:
+        return future.result()
+
+    try:
+        result = _post_chat_completion(image_url, prompt, api_key, max_tokens)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        _response_cache_put(key, result)
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+def _request_key(image_url, prompt, api_key, max_tokens):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (api_key, prompt, str(max_tokens), *_image_urls(image_url)):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.digest()
+
+
+def _response_cache_get(key):
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _response_cache[key]
+            return None
+        _response_cache.move_to_end(key)
+        return entry[1]
+
+
+def _response_cache_put(key, text):
+    # A blank reply is never worth replaying: it would hide the next attempt's real answer
+    if not text:
+        return
+    with _response_cache_lock:
+        _response_cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, text)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            _response_cache.popitem(last=False)
+
+
+def _post_chat_completion(image_url, prompt, api_key, max_tokens):
+    with _api_slots:
+        resp = get_session().post(
+            CHAT_COMPLETIONS_URL,
+            headers={"Authorization": f"Bearer {api_key}"},
+            data=_payload(image_url, prompt, max_tokens),
+            timeout=API_TIMEOUT
+        )
+    resp.raise_for_status()
+    return json.loads(resp.content)['choices'][0]['message']['content']
+
+
+def stream_chat_completion(image_url, prompt, api_key, max_tokens):
+    """Like chat_completion, but yields the reply text piece by piece as the API streams it.
+
+    Streams are not shared between callers; each one gets its own request. A reply cached
+    by an earlier identical request is yielded whole, and a completed stream is cached.
+    """
+    key = _request_key(image_url, prompt, api_key, max_tokens)
+    cached = _response_cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    with _api_slots, get_session().post(
+        CHAT_COMPLETIONS_URL,
+        headers={"Authorization": f"Bearer {api_key}"},
+        data=_payload(image_url, prompt, max_tokens, stream=True),
+        timeout=API_TIMEOUT,
+        stream=True
+    ) as resp:
+        resp.raise_for_status()
+        resp.encoding = "utf-8"
+        # Server-sent events: one "data: {...}" line per chunk, terminated by "data: [DONE]"
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            # Failures after the 200 status line arrive as an in-band error event
+            if event.get('error'):
+                error = event['error']
+                raise RuntimeError(error.get('message', str(error)) if isinstance(error, dict) else str(error))
+            choices = event.get('choices')
+            delta = choices[0].get('delta', {}).get('content') if choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    _response_cache_put(key, "".join(parts))
+
+
+def error_message(e):
+    """User-facing text for a failed API call."""
+    response = getattr(e, "response", None)
+    if response is not None and response.status_code == 429:
+        return "Error: Rate limited by the Z AI API. Please wait a moment and try again."
+    return f"Error: {str(e)}"
+
+
+def encode_frame(img):
+    """Encode an in-memory PIL frame as a JPEG data URL without going through a file."""
+    out = _DataURLWriter("JPEG")
+    img.save(out, "JPEG", quality=JPEG_QUALITY)
+    return out.data_url()
+
+
+def analyze_image(img, api_key):
+    """Analyze a single in-memory video frame using the AI API."""
+    if not api_key:
+        return DEMO_MODE_MESSAGE
+
+    try:
+        return chat_completion(encode_frame(img), FRAME_PROMPT, api_key, 1024)
+    except Exception as e:
+        return error_message(e)
+
+
+def analyze_frames(images, api_key):
+    """Analyze consecutive in-memory video frames in one request; returns one analysis per frame."""
+    if not api_key:
+        return [DEMO_MODE_MESSAGE] * len(images)
+
+    prompt = BATCH_FRAME_PROMPT.format(count=len(images))
+    try:
+        reply = chat_completion(tuple(encode_frame(img) for img in images), prompt, api_key, 1024 * len(images))
+    except Exception as e:
+        return [error_message(e)] * len(images)
+    return _split_batch_reply(reply, len(images))
+
+
+def _split_batch_reply(reply, count):
+    # The reply should be a JSON object keyed by frame number, possibly wrapped in a code fence
+    start, end = reply.find("{"), reply.rfind("}")
+    try:
+        analyses = json.loads(reply[start:end + 1]) if start != -1 else None
+    except ValueError:
+        analyses = None
+    # Keys may come back as "1" or spelled out as "Frame 1"; anything else can't be matched to frames
+    by_frame = {}
+    if isinstance(analyses, dict):
+        for name, analysis in analyses.items():
+            number = re.search(r"\d+", str(name))
+            if number is not None:
+                by_frame.setdefault(int(number.group()), analysis)
+    if not any(i in by_frame for i in range(1, count + 1)):
+        return [reply] + [BATCH_UNSPLIT_MESSAGE] * (count - 1)
+    return [_format_analysis(by_frame[i]) if i in by_frame else NO_FRAME_ANALYSIS_MESSAGE
+            for i in range(1, count + 1)]
+
+
+def _format_analysis(analysis):
+    """Readable text for one frame's entry, which the model may structure as an object or list."""
+    if isinstance(analysis, dict):
+        lines = []
+        for name, value in analysis.items():
+            text = _format_analysis(value)
+            lines.append(f"{name}:\n  " + text.replace("\n", "\n  ") if "\n" in text else f"{name}: {text}")
+        return "\n".join(lines)
+    if isinstance(analysis, list):
+        if not any(isinstance(value, (dict, list)) for value in analysis):
+            return ", ".join(str(value) for value in analysis)
+        return "\n".join("- " + _format_analysis(value).replace("\n", "\n  ") for value in analysis)
+    return str(analysis)
+
+
+def analyze_video(video_path, num_frames, api_key, detailed=True, progress=None):
+    """Extract frames and analyze them with AI, overlapping decoding with the API calls.
+
+    Each RGB frame is downscaled to MAX_IMAGE_SIDE as soon as it is decoded and sent for
+    analysis straight from memory: on its own when detailed, otherwise in requests of up to
+    BATCH_MAX_FRAMES consecutive frames. progress, if given, is called with the number of
+    frames decoded so far. Returns the downscaled PIL frames, the analyses in frame order
+    and the extraction info; the first two are None if extraction failed.
+    """
+    images, futures = [], []
+    with ThreadPoolExecutor(max_workers=FRAME_CONCURRENCY) as executor:
+        def submit(frame):
+            img = PILImage.fromarray(frame)
+            images.append(img)
+            if progress is not None:
+                progress(len(images))
+            # Frames are JPEG-encoded in memory and sent from a worker thread,
+            # so the request is in flight while the decoder moves on
+            if detailed:
+                futures.append(executor.submit(analyze_image, img, api_key))
+            elif len(images) % BATCH_MAX_FRAMES == 0:
+                futures.append(executor.submit(analyze_frames, images[-BATCH_MAX_FRAMES:], api_key))
+
+        frames, extraction_info = extract_frames_from_video(video_path, num_frames, on_frame=submit,
+                                                            max_side=MAX_IMAGE_SIDE)
+        if frames is None:
+            for future in futures:
+                future.cancel()
+            return None, None, extraction_info
+        if not detailed and len(images) % BATCH_MAX_FRAMES:
+            futures.append(executor.submit(analyze_frames, images[-(len(images) % BATCH_MAX_FRAMES):], api_key))
+        results = [future.result() for future in futures]
+    analyses = results if detailed else [analysis for batch in results for analysis in batch]
+    return images, analyses, extraction_info
+
+
+@functools.cache
+def video_backend():
+    """The usable frame decoder: "av" (PyAV) preferred, then "cv2", else None."""
+    # A real import rather than find_spec: the package can be installed while its
+    # native libraries are not (e.g. OpenCV without libGL). The answer, None included,
+    # is cached for the life of the process, as installed packages don't change under it
+    for module in ("av", "cv2"):
+        try:
+            importlib.import_module(module)
+        except (ImportError, OSError):
+            continue
+        return module
+    return None
+
+
+def extract_frames_from_video(video_path, num_frames=10, on_frame=None, max_side=None):
+    """Extract evenly spaced RGB frames from a video with PyAV, or OpenCV as a fallback.
+
+    on_frame, if given, is called with each frame as soon as it has been decoded.
+    With max_side, frames are scaled down to fit it as part of the RGB conversion,
+    so a full-resolution RGB copy of each frame is never made.
+    """
+    backend = video_backend()
+    if backend is None:
+        return None, "Video processing requires PyAV or OpenCV, neither of which is available in this environment."
+
+    try:
+        if backend == "av":
+            return _extract_frames_av(video_path, num_frames, on_frame, max_side)
+        return _extract_frames_cv2(video_path, num_frames, on_frame, max_side)
+    except Exception as e:
+        return None, f"Error extracting frames: {str(e)}"
+
+
+def _extraction_info(frames, duration, total_frames, fps):
+    return f"Extracted {len(frames)} frames from {duration:.2f}s video ({total_frames} total frames at {fps:.2f} fps)"
+
+
+def _fit_size(width, height, max_side):
+    """(width, height) scaled down to fit within max_side, keeping the aspect ratio."""
+    scale = max_side / max(width, height) if max_side else 1
+    if scale >= 1:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _add_frame(frames, frame, on_frame):
+    frames.append(frame)
+    if on_frame is not None:
+        on_frame(frame)
+
+
+def _extract_frames_av(video_path, num_frames, on_frame, max_side):
+    # Imported here so the decoder libs only load once the video tab is used
+    import av
+
+    def to_rgb(frame):
+        # swscale resizes and converts from YUV in a single pass
+        width, height = _fit_size(frame.width, frame.height, max_side)
+        if (width, height) == (frame.width, frame.height):
+            return frame.to_ndarray(format="rgb24")
+        return frame.to_ndarray(format="rgb24", width=width, height=height, interpolation="AREA")
+
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        fps = float(stream.average_rate or 0)
+        if stream.duration:
+            duration = float(stream.duration * stream.time_base)
+        else:
+            duration = container.duration / av.time_base if container.duration else 0
+        total_frames = stream.frames or int(duration * fps)
+        span = stream.duration
+
+        if not total_frames:
+            # No frame count or duration in the headers (e.g. a MediaRecorder WebM):
+            # demux once without decoding to count the frames and find their time span
+            pts = sorted(packet.pts for packet in container.demux(stream) if packet.pts is not None)
+            total_frames = len(pts)
+            if pts:
+                span = pts[-1] - pts[0] + 1
+                duration = duration or float(span * stream.time_base)
+            container.seek(0)
+
+        frames = []
+        if total_frames <= num_frames:
+            for frame in container.decode(stream):
+                _add_frame(frames, to_rgb(frame), on_frame)
+                # The count can be short of the real length; never return more than asked for
+                if len(frames) >= num_frames:
+                    break
+        else:
+            # Seek to the keyframe before each evenly spaced timestamp and take that
+            # keyframe: with non-key frames skipped each sample is a single decode.
+            # Where keyframes are sparser than the samples the same one would come
+            # back twice, so decode forward to the exact timestamp instead.
+            # Frames come out of the decoder already in RGB.
+            start = stream.start_time or 0
+            span = span or int(duration / stream.time_base)
+            codec = stream.codec_context
+            seen = set()
+            for i in range(num_frames):
+                target = start + span * i // num_frames
+                container.seek(target, stream=stream)
+                codec.skip_frame = "NONKEY"
+                frame = next(container.decode(stream), None)
+                if frame is not None and frame.pts in seen:
+                    codec.skip_frame = "DEFAULT"
+                    container.seek(target, stream=stream)
+                    frame = next((f for f in container.decode(stream) if f.pts is None or f.pts >= target), None)
+                if frame is not None:
+                    seen.add(frame.pts)
+                    _add_frame(frames, to_rgb(frame), on_frame)
+
+    return frames, _extraction_info(frames, duration, total_frames, fps)
+
+
+def _extract_frames_cv2(video_path, num_frames, on_frame, max_side):
+    # Imported here so the OpenCV native libs only load once the video tab is used
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None, "Could not open video file."
+
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    duration = total_frames / fps if fps > 0 else 0
+    cap.release()
+
+    # Calculate frame indices to extract
+    if total_frames <= num_frames:
+        frame_indices = list(range(total_frames))
+    else:
+        # Extract evenly distributed frames
+        frame_indices = [int(i * total_frames / num_frames) for i in range(num_frames)]
+
+    # Long videos are split into contiguous segments decoded in parallel, each
+    # with its own capture; OpenCV releases the GIL while it decodes
+    segments = max(1, min(DECODE_SEGMENTS, len(frame_indices)))
+    bounds = [len(frame_indices) * k // segments for k in range(segments + 1)]
+    chunks = [frame_indices[a:b] for a, b in zip(bounds, bounds[1:])]
+    frames = []
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        for chunk in executor.map(functools.partial(_decode_segment_cv2, video_path, max_side=max_side), chunks):
+            for frame in chunk:
+                _add_frame(frames, frame, on_frame)
+
+    return frames, _extraction_info(frames, duration, total_frames, fps)
+
+
+def _decode_segment_cv2(video_path, frame_indices, max_side=None):
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+
+    # Walk the segment once: grab() advances without converting to an image,
+    # and only the sampled frames are retrieve()d. Seeking per sample would
+    # re-decode from the previous keyframe every time, so it is only used to
+    # jump gaps long enough that grabbing through them would cost more.
+    frames = []
+    targets = iter(frame_indices)
+    next_idx = next(targets, None)
+    pos = 0
+    while next_idx is not None:
+        if next_idx - pos > CV2_SEEK_MIN_GAP:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, next_idx)
+            pos = next_idx
+        if not cap.grab():
+            break
+        if pos == next_idx:
+            ret, frame = cap.retrieve()
+            if ret:
+                # Resize before the colour conversion so it runs on fewer pixels
+                size = _fit_size(frame.shape[1], frame.shape[0], max_side)
+                if size != (frame.shape[1], frame.shape[0]):
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                # Convert BGR to RGB in place; retrieve() and resize() hand back a
+                # fresh array each time, so no second buffer is needed
+                frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame))
+            next_idx = next(targets, None)
+        pos += 1
+
+    cap.release()
+    return frames
@@ -1,160 +1,102 @@
 import streamlit as st
+import contextlib
 import os
-import base64
 import tempfile
-try:
-    import cv2
-    import numpy as np
-    OPENCV_AVAILABLE = True
-except ImportError:
-    OPENCV_AVAILABLE = False
-from PIL import Image as PILImage
-from io import BytesIO
-import requests
-
-# Configuration
-API_URL = os.environ.get("ZAI_BASE_URL", "https://api.z.ai/api/paas/v4")
-MODEL = os.environ.get("ZAI_MODEL_VISION", "glm-4.6v")
-
-
-def encode_image(img_path):
-    """Encode image to base64 for API transmission."""
-    if img_path is None:
-        return None
-    buffered = BytesIO()
-    PILImage.open(img_path).save(buffered, "PNG")
-    return f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-
-
-def call_api(img_path, prompt, api_key):
-    """Make API call to Z AI."""
-    if not img_path:
-        return "Please upload an image."
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _core import (
+    ANALYZE_PROMPTS,
+    CHAT_DEFAULT_PROMPT,
+    DEMO_IMAGE_MESSAGE,
+    DEMO_VIDEO_MESSAGE,
+    DETAIL_LEVELS,
+    LOW_DETAIL_IMAGE_SIDE,
+    MAX_IMAGE_SIDE,
+    NO_IMAGE_MESSAGE,
+    NO_VIDEO_MESSAGE,
+    OCR_LANGUAGES,
+    OCR_PROMPTS,
+    SEARCH_PROMPTS,
+    SEARCH_TYPES,
+    analyze_video,
+    encode_image,
+    error_message,
+    stream_chat_completion,
+    video_backend,
+)
 
-    if not api_key:
-        return "**Demo Mode** - Enter your Z AI API key above for real AI.\n\nUpload an image and enter your key to use real AI."
 
-    try:
-        resp = requests.post(
-            f"{API_URL}/chat/completions",
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={
-                "model": MODEL,
-                "messages": [{
-                    "role": "user",
-                    "content": [
-                        {"type": "image_url", "image_url": {"url": encode_image(img_path)}},
-                        {"type": "text", "text": prompt}
-                    ]
-                }],
-                "max_tokens": 2048
-            },
-            timeout=60
-        )
-        resp.raise_for_status()
-        return resp.json()['choices'][0]['message']['content']
-    except Exception as e:
-        return f"Error: {str(e)}"
+@st.cache_data(max_entries=16, show_spinner=False)
+def encode_upload(file_id, max_side, _upload):
+    """Data URL for an uploaded image, cached across reruns by Streamlit's upload id.
 
+    Reruns and repeat clicks for the same upload skip even the content hash; the same
+    image uploaded again on another tab is still caught by encode_image's own cache.
+    """
+    return encode_image(_upload, max_side)
 
-def analyze_image(img_path, api_key):
-    """Analyze a single image using AI API."""
+
+def call_api(img, prompt, api_key, output, max_side=MAX_IMAGE_SIDE):
+    """Make API call to Z AI, rendering the reply into the output placeholder as it streams in.
+
+    Returns the full reply (or an error/demo message) once the stream ends.
+    """
+    if not img:
+        return NO_IMAGE_MESSAGE
     if not api_key:
-        return "**Demo Mode** - Enter your Z AI API key above for real AI."
+        return DEMO_IMAGE_MESSAGE
 
     try:
-        resp = requests.post(
-            f"{API_URL}/chat/completions",
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={
-                "model": MODEL,
-                "messages": [{
-                    "role": "user",
-                    "content": [
-                        {"type": "image_url", "image_url": {"url": encode_image(img_path)}},
-                        {"type": "text", "text": "Analyze this video frame. Describe what you see in detail including objects, people, actions, setting, and any notable elements."}
-                    ]
-                }],
-                "max_tokens": 1024
-            },
-            timeout=60
-        )
-        resp.raise_for_status()
-        return resp.json()['choices'][0]['message']['content']
+        text = ""
+        for delta in stream_chat_completion(encode_upload(img.file_id, max_side, img), prompt, api_key, 2048):
+            text += delta
+            output.markdown(text)
+        return text
     except Exception as e:
-        return f"Error: {str(e)}"
+        return error_message(e)
+
 
+@st.cache_resource
+def get_video_executor():
+    """Process-wide pool that runs video jobs outside the script thread; survives reruns."""
+    return ThreadPoolExecutor(max_workers=2)
 
-def extract_frames_from_video(video_path, num_frames=10):
-    """Extract frames from video using OpenCV."""
-    if not OPENCV_AVAILABLE:
-        return None, "Video processing requires OpenCV which is not available in this environment."
 
+@contextlib.contextmanager
+def video_source(video_file):
+    """The upload itself for PyAV; OpenCV only opens paths, so it gets a temporary copy on disk."""
+    if video_backend() != "cv2":
+        yield video_file
+        return
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(video_file.name)[1], delete=False) as tmp:
+        tmp.write(video_file.getbuffer())
     try:
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            return None, "Could not open video file."
-
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        duration = total_frames / fps if fps > 0 else 0
-
-        # Calculate frame indices to extract
-        if total_frames <= num_frames:
-            frame_indices = list(range(total_frames))
-        else:
-            # Extract evenly distributed frames
-            frame_indices = [int(i * total_frames / num_frames) for i in range(num_frames)]
-
-        frames = []
-        for idx in frame_indices:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-            ret, frame = cap.read()
-            if ret:
-                # Convert BGR to RGB
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frames.append(frame_rgb)
-
-        cap.release()
-        return frames, f"Extracted {len(frames)} frames from {duration:.2f}s video ({total_frames} total frames at {fps:.2f} fps)"
-    except Exception as e:
-        return None, f"Error extracting frames: {str(e)}"
+        yield tmp.name
+    finally:
+        os.unlink(tmp.name)
 
 
-def process_video(video_file, num_frames, api_key):
+def process_video(video_file, num_frames, detailed, api_key, progress=None):
     """Process video: extract frames and analyze each with AI."""
     if video_file is None:
-        return None, "Please upload a video file.", []
+        return None, NO_VIDEO_MESSAGE, []
 
     if not api_key:
-        return None, "**Demo Mode** - Enter your Z AI API key above for real AI.\n\nUpload a video and enter your key to use real AI.", []
+        return None, DEMO_VIDEO_MESSAGE, []
 
     try:
-        # Extract frames from video
-        frames, extraction_info = extract_frames_from_video(video_file, num_frames)
+        # Extract frames and analyze them while the next ones are being decoded
+        with video_source(video_file) as source:
+            pil_images, analyses, extraction_info = analyze_video(source, num_frames, api_key, detailed, progress)
 
-        if frames is None:
+        if pil_images is None:
             return None, extraction_info, []
 
-        # Analyze each frame
-        frame_analyses = []
-        for i, frame in enumerate(frames):
-            # Convert numpy array to PIL Image
-            img_pil = PILImage.fromarray(frame)
-
-            # Save to temp file
-            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                img_pil.save(tmp.name)
-                tmp_path = tmp.name
-
-            # Analyze frame
-            analysis = analyze_image(tmp_path, api_key)
-            frame_analyses.append({
-                'frame_number': i + 1,
-                'analysis': analysis,
-                'image_path': tmp_path,
-                'pil_image': img_pil
-            })
+        frame_analyses = [
+            {'frame_number': i + 1, 'analysis': analysis, 'pil_image': img_pil}
+            for i, (analysis, img_pil) in enumerate(zip(analyses, pil_images))
+        ]
 
         # Return first frame and analyses
         first_frame_pil = frame_analyses[0]['pil_image'] if frame_analyses else None
@@ -198,12 +140,19 @@ with tab1:
     col1, col2 = st.columns(2)
     with col1:
         img1 = st.file_uploader("Upload Image", type=['png', 'jpg', 'jpeg', 'gif', 'webp'], key="img1")
-        detail1 = st.radio("Detail Level", ["low", "high", "auto"], index=1, key="detail1")
+        detail1 = st.radio("Detail Level", DETAIL_LEVELS, index=1, key="detail1")
         btn1 = st.button("Analyze Image", type="primary", key="btn1")
     with col2:
+        out1 = st.empty()
         if btn1 and img1:
-            result = call_api(img1, f"Analyze this image in {detail1} detail. Describe the scene, objects, colors, and mood.", api_key)
-            st.text_area("Analysis Result", result, height=300, key="out1")
+            max_side = LOW_DETAIL_IMAGE_SIDE if detail1 == "low" else MAX_IMAGE_SIDE
+            st.session_state.result1 = (img1.file_id, call_api(img1, ANALYZE_PROMPTS.get(detail1, ANALYZE_PROMPTS["high"]), api_key, out1, max_side))
+        # The reply is kept with the id of the upload it was made for, so any other rerun (another
+        # tab's click, the video tab polling its job) shows it again, but never next to a
+        # different image; same in each tab
+        result1 = st.session_state.get("result1")
+        if img1 and result1 and result1[0] == img1.file_id:
+            out1.text_area("Analysis Result", result1[1], height=300)
 
 # Tab 2: OCR
 with tab2:
@@ -211,12 +160,15 @@ with tab2:
     col1, col2 = st.columns(2)
     with col1:
         img2 = st.file_uploader("Upload Image", type=['png', 'jpg', 'jpeg', 'gif', 'webp'], key="img2")
-        lang2 = st.selectbox("Language", ["auto", "english", "chinese", "spanish", "french", "german"], index=0, key="lang2")
+        lang2 = st.selectbox("Language", OCR_LANGUAGES, index=0, key="lang2")
         btn2 = st.button("Extract Text", type="primary", key="btn2")
     with col2:
+        out2 = st.empty()
         if btn2 and img2:
-            result = call_api(img2, f"Extract all text from this image. Language: {lang2}. Preserve original formatting and structure.", api_key)
-            st.text_area("Extracted Text", result, height=350, key="out2")
+            st.session_state.result2 = (img2.file_id, call_api(img2, OCR_PROMPTS.get(lang2, OCR_PROMPTS["auto"]), api_key, out2))
+        result2 = st.session_state.get("result2")
+        if img2 and result2 and result2[0] == img2.file_id:
+            out2.text_area("Extracted Text", result2[1], height=350)
 
 # Tab 3: Vision Search
 with tab3:
@@ -224,12 +176,15 @@ with tab3:
     col1, col2 = st.columns(2)
     with col1:
         img3 = st.file_uploader("Upload Image", type=['png', 'jpg', 'jpeg', 'gif', 'webp'], key="img3")
-        stype3 = st.radio("Search Type", ["web", "products", "similar"], index=0, key="stype3")
+        stype3 = st.radio("Search Type", SEARCH_TYPES, index=0, key="stype3")
         btn3 = st.button("Search", type="primary", key="btn3")
     with col2:
+        out3 = st.empty()
         if btn3 and img3:
-            result = call_api(img3, f"Describe this image. What search terms would find this on the web for {stype3}?", api_key)
-            st.text_area("Search Results", result, height=300, key="out3")
+            st.session_state.result3 = (img3.file_id, call_api(img3, SEARCH_PROMPTS.get(stype3, SEARCH_PROMPTS["web"]), api_key, out3))
+        result3 = st.session_state.get("result3")
+        if img3 and result3 and result3[0] == img3.file_id:
+            out3.text_area("Search Results", result3[1], height=300)
 
 # Tab 4: Vision Chat
 with tab4:
@@ -237,63 +192,99 @@ with tab4:
     col1, col2 = st.columns(2)
     with col1:
         img4 = st.file_uploader("Upload Image", type=['png', 'jpg', 'jpeg', 'gif', 'webp'], key="img4")
-        prompt4 = st.text_input("Your Question", placeholder="What do you see in this image?", key="prompt4")
+        prompt4 = st.text_input("Your Question", placeholder=CHAT_DEFAULT_PROMPT, key="prompt4")
         btn4 = st.button("Ask", type="primary", key="btn4")
     with col2:
+        out4 = st.empty()
         if btn4 and img4:
-            result = call_api(img4, prompt4 or "What do you see in this image?", api_key)
-            st.text_area("AI Response", result, height=300, key="out4")
+            st.session_state.result4 = (img4.file_id, call_api(img4, prompt4 or CHAT_DEFAULT_PROMPT, api_key, out4))
+        result4 = st.session_state.get("result4")
+        if img4 and result4 and result4[0] == img4.file_id:
+            out4.text_area("AI Response", result4[1], height=300)
 
 # Tab 5: Video Processing
 with tab5:
     st.subheader("Video Processing")
 
-    if not OPENCV_AVAILABLE:
-        st.error("🚫 **Video processing is not available in this environment.**\n\nOpenCV requires system libraries that aren't installed on Streamlit Cloud. Please use the [Gradio version on Hugging Face](https://huggingface.co/spaces/tacofairy/zai-vision-suite) for video processing features.")
-    else:
-        col1, col2 = st.columns(2)
-
-        with col1:
-            video5 = st.file_uploader("Upload Video", type=['mp4', 'webm', 'mov'], key="video5")
-            num_frames5 = st.slider("Number of Frames to Extract", min_value=1, max_value=50, value=10, step=1, key="num_frames5")
-            btn5 = st.button("Process Video", type="primary", key="btn5")
-
-        with col2:
-            if btn5 and video5:
-                with st.spinner("Processing video..."):
-                    first_frame, extraction_info, frame_analyses = process_video(video5, num_frames5, api_key)
-
-                    if first_frame is not None:
-                        st.success("Video processed successfully!")
-
-                        # Display extraction info
-                        st.info(extraction_info)
-
-                        # Frame viewer
-                        st.subheader("Frame Viewer")
-
-                        # Frame slider
-                        frame_idx = st.slider(
-                            "Select Frame",
-                            min_value=1,
-                            max_value=len(frame_analyses),
-                            value=1,
-                            step=1
-                        )
-
-                        # Display selected frame
-                        if frame_analyses and 1 <= frame_idx <= len(frame_analyses):
-                            fa = frame_analyses[frame_idx - 1]
-                            st.image(fa['pil_image'], caption=f"Frame {fa['frame_number']}", use_container_width=True)
-                            st.markdown(f"**Frame {fa['frame_number']} Analysis:**")
-                            st.write(fa['analysis'])
-
-                        # Summary
-                        st.subheader("Video Summary")
-                        summary = f"## Video Processing Summary\n\n{extraction_info}\n\n### Frame Analysis Results:\n\n"
-                        for fa in frame_analyses:
-                            summary += f"**Frame {fa['frame_number']}:**\n{fa['analysis']}\n\n"
-                        st.markdown(summary)
+    col1, col2 = st.columns(2)
+    # One job per session: a second click would leave the first one running (and calling
+    # the API) in one of the few workers that every session shares
+    job = st.session_state.get("video5_job")
+    job_running = job is not None and not job[2].done()
+
+    with col1:
+        video5 = st.file_uploader("Upload Video", type=['mp4', 'webm', 'mov'], key="video5")
+        num_frames5 = st.slider("Number of Frames to Extract", min_value=1, max_value=50, value=10, step=1, key="num_frames5")
+        detailed5 = st.checkbox("Detailed mode (one request per frame)", value=False, key="detailed5")
+        btn5 = st.button("Process Video", type="primary", key="btn5", disabled=job_running)
+
+    with col2:
+        if btn5 and video5 and video_backend() is None:
+            # The decoder is only probed (and imported) on the first click, so a cold start
+            # doesn't load PyAV or OpenCV for users who never process a video
+            st.error("🚫 **Video processing is not available in this environment.**\n\nInstall PyAV (`av`) or OpenCV to enable it, or use the [Gradio version on Hugging Face](https://huggingface.co/spaces/tacofairy/zai-vision-suite) for video processing features.")
+        elif btn5 and video5 and not job_running:
+            # The job runs in a background thread so the script (and every widget)
+            # isn't blocked while frames are decoded and analyzed
+            progress = {"frames": 0}
+            st.session_state.video5_job = (
+                (video5.file_id, num_frames5, detailed5),
+                progress,
+                get_video_executor().submit(process_video, video5, num_frames5, detailed5, api_key,
+                                            lambda n: progress.update(frames=n)),
+            )
+
+        job = st.session_state.get("video5_job")
+        if job is not None:
+            params, progress, future = job
+            if not future.done():
+                decoded = min(progress["frames"], params[1])
+                st.progress(decoded / params[1], text=f"Processing video... {decoded} of {params[1]} frames extracted")
+                time.sleep(0.5)
+                st.rerun()
+            # Kept in session state: moving the frame slider reruns the script, and the
+            # stored frames and analyses are shown instead of processing the video again
+            st.session_state.video5_result = (params, future.result())
+            del st.session_state.video5_job
+            if job_running:
+                # Finished after the button was drawn disabled; redraw it enabled
+                st.rerun()
+
+        result = st.session_state.get("video5_result")
+        if video5 and result and result[0] == (video5.file_id, num_frames5, detailed5):
+            first_frame, extraction_info, frame_analyses = result[1]
+
+            if first_frame is not None:
+                st.success("Video processed successfully!")
+
+                # Display extraction info
+                st.info(extraction_info)
+
+                # Frame viewer
+                st.subheader("Frame Viewer")
+
+                # Frame slider
+                frame_idx = st.slider(
+                    "Select Frame",
+                    min_value=1,
+                    max_value=len(frame_analyses),
+                    value=1,
+                    step=1
+                )
+
+                # Display selected frame
+                if frame_analyses and 1 <= frame_idx <= len(frame_analyses):
+                    fa = frame_analyses[frame_idx - 1]
+                    st.image(fa['pil_image'], caption=f"Frame {fa['frame_number']}", use_container_width=True)
+                    st.markdown(f"**Frame {fa['frame_number']} Analysis:**")
+                    st.write(fa['analysis'])
+
+                # Summary
+                st.subheader("Video Summary")
+                summary = f"## Video Processing Summary\n\n{extraction_info}\n\n### Frame Analysis Results:\n\n"
+                for fa in frame_analyses:
+                    summary += f"**Frame {fa['frame_number']}:**\n{fa['analysis']}\n\n"
+                st.markdown(summary)
 
 # Footer
 st.markdown("---\n### 🔑 Get Your API Key\n\nVisit [Z AI](https://z.ai/) to sign up and get your free API key.")